@@ -1,28 +1,139 @@
+import asyncio
+import copyreg
+import io
+import multiprocessing
 import os
 import logging
-import tempfile
-from datetime import datetime
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
 from typing import Optional
+from urllib.parse import quote
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
 from pydantic import BaseModel, ConfigDict
-import gpxpy
+from lxml import etree
 from dotenv import load_dotenv
 import math
+import numpy as np
 
 load_dotenv()
 
+# Imported after load_dotenv() so NUMBA_CACHE_DIR can be set from the .env file
+from numba import config as numba_config, njit, prange, set_num_threads
+
+try:
+    # Optional compiled reconstruction kernel, built with: python setup.py build_ext --inplace
+    from reconstruct import reconstruct as _reconstruct_ext
+except ImportError:
+    _reconstruct_ext = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+log_level = (os.getenv('LOG_LEVEL') or 'INFO').strip().upper()
+if isinstance(logging.getLevelName(log_level), int):
+    logger.setLevel(log_level)
+else:
+    logger.setLevel(logging.INFO)
+    logger.warning(f"Unknown LOG_LEVEL {log_level!r}, falling back to INFO")
+
+# Earth's radius in meters
+EARTH_RADIUS = 6371000.0
+
+# Degree/radian conversion factors, cheaper than math.radians/math.degrees on scalars
+_DEG2RAD = math.pi / 180.0
+_RAD2DEG = 180.0 / math.pi
+
+# Segments whose angular length is under this (~100 m) use the equirectangular approximation
+# and a flat-Earth reconstruction, which stay within a centimeter of the Haversine formulas
+_SHORT_SEGMENT_DEG = 0.001
+_SHORT_SEGMENT_RAD = _SHORT_SEGMENT_DEG * _DEG2RAD
+
+GPX_10_NAMESPACE = 'http://www.topografix.com/GPX/1/0'
+
+# Process pool running the CPU-bound anonymization off the event loop, see _get_pool()
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Cores are split between worker processes and the Numba threads each one uses for the
+# parallel kernel: one thread per worker by default, which favors concurrent requests
+threads_per_worker = os.getenv('NUMBA_THREADS_PER_WORKER') or '1'
+if threads_per_worker.strip().isdigit() and int(threads_per_worker) >= 1:
+    _THREADS_PER_WORKER = min(int(threads_per_worker), numba_config.NUMBA_NUM_THREADS)
+else:
+    _THREADS_PER_WORKER = 1
+    logger.warning(f"Invalid NUMBA_THREADS_PER_WORKER {threads_per_worker!r}, falling back to 1")
+_POOL_WORKERS = max(1, (os.cpu_count() or 1) // _THREADS_PER_WORKER)
+
+def _pickle_http_exception(exc: HTTPException):
+    """HTTPException can't be unpickled as is, which is needed to raise it from pool workers.
+
+    Its __init__ requires status_code while pickle only replays the exception args
+    (still the case with Starlette 1.7).
+    """
+    return HTTPException, (exc.status_code, exc.detail, exc.headers)
+
+copyreg.pickle(HTTPException, _pickle_http_exception)
+
+def _compile_kernels():
+    """Compile the Numba kernels so the first request doesn't pay for it."""
+    dists, bearings = _analyze(np.array([0.0, 0.001]), np.array([0.0, 0.001]), EARTH_RADIUS)
+    if _reconstruct_ext is None:
+        _reconstruct(dists, bearings, EARTH_RADIUS)
+
+def _start_worker():
+    """Pool job that does nothing, the worker's initializer has already compiled the kernels when it runs."""
+
+def _init_worker():
+    """Set up a pool worker: limit its Numba threads to its share of the cores and compile the kernels."""
+    set_num_threads(_THREADS_PER_WORKER)
+    _compile_kernels()
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Return the worker pool, creating it on first use.
+
+    Every worker compiles the kernels in its initializer before taking a job, so when the
+    lifespan didn't start the workers up front the first request each one gets waits for it.
+
+    The kernels must never run on a thread of the server process: the parallel kernel
+    called from a non-main thread can hang the interpreter at exit.
+    """
+    global _pool
+    if _pool is None:
+        # Workers are spawned rather than forked, forking a process that may already run Numba threads is unsafe
+        _pool = ProcessPoolExecutor(
+            max_workers=_POOL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker
+        )
+    return _pool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the worker processes and wait until their initializers compiled the Numba kernels."""
+    global _pool
+    pool = _get_pool()
+    # The pool only spawns a worker when a job arrives, so submit an empty one per worker up front.
+    # Each job runs after its worker's initializer, the parent process never runs the kernels itself.
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(pool, _start_worker) for _ in range(_POOL_WORKERS)))
+    logger.info(f"Numba kernels compiled in {_POOL_WORKERS} worker processes")
+    yield
+    # The pool may have been replaced since startup if a worker died
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
 app = FastAPI(
     title="GPX Anonymizer Service",
     description="A service to anonymize GPX files by translating coordinates while preserving relative distances",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -51,133 +162,259 @@ class AnonymizedGPXResponse(BaseModel):
         }
     )
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate the distance between two points using the Haversine formula."""
+def _parse_track_points(content: bytes) -> tuple[np.ndarray, np.ndarray, etree._Element]:
+    """Stream the points of the first track segment into coordinate arrays and a detached segment."""
+    segment = None
+    version = None
+    found_track = False
+    done = False
+
+    context = etree.iterparse(
+        io.BytesIO(content),
+        events=('start', 'end'),
+        tag=('{*}gpx', '{*}trk', '{*}trkseg', '{*}trkpt'),
+        # Internal entities are expanded so the output stays well-formed without the DTD, external ones (XXE) are refused
+        resolve_entities='internal'
+    )
+    for event, element in context:
+        if done:
+            # Keep parsing so that malformed XML after the first segment is still rejected
+            if event == 'end':
+                element.clear()
+            continue
+
+        qname = etree.QName(element)
+        if event == 'start':
+            if qname.localname == 'gpx':
+                version = element.get('version')
+            elif qname.localname == 'trk':
+                found_track = True
+            elif qname.localname == 'trkseg':
+                # Only the first segment is kept, inside a new document without the original metadata
+                ns = f'{{{qname.namespace}}}' if qname.namespace else ''
+                # Keep the source version so that it matches the namespace (GPX 1.0 or 1.1)
+                if version is None:
+                    version = '1.0' if qname.namespace == GPX_10_NAMESPACE else '1.1'
+                gpx = etree.Element(f'{ns}gpx', nsmap=element.nsmap, version=version, creator='gpx-anonymous')
+                segment = etree.SubElement(etree.SubElement(gpx, f'{ns}trk'), f'{ns}trkseg')
+            continue
+
+        if qname.localname != 'trkpt':
+            # End of the first segment (or of a track without any), the rest is ignored
+            done = True
+            continue
+
+        # Move the point out of the parsed tree, its elevation, time and extensions are kept as is
+        segment.append(element)
+
+    if not found_track:
+        raise ValueError("No tracks found in GPX file")
+    if segment is None:
+        raise ValueError("No segments found in track")
+    count = len(segment)
+    if not count:
+        raise ValueError("No points found in segment")
+
+    # Fill preallocated arrays from the collected points rather than growing buffers while parsing
+    lats = np.fromiter((float(p.get('lat')) for p in segment), dtype=np.float64, count=count)
+    lons = np.fromiter((float(p.get('lon')) for p in segment), dtype=np.float64, count=count)
+
+    # float() accepts "nan" and "inf", which the kernels (compiled with fastmath) can't handle
+    if not (np.isfinite(lats).all() and np.isfinite(lons).all()):
+        raise ValueError("Track points must have finite coordinates")
+    if (np.abs(lats) > 90).any() or (np.abs(lons) > 180).any():
+        raise ValueError("Track point coordinates out of range")
+
+    return lats, lons, segment
+
+def _build_gpx(segment: etree._Element, lats: np.ndarray, lons: np.ndarray) -> bytes:
+    """Write the anonymized coordinates onto the track points and serialize their document as UTF-8."""
+    for point, lat, lon in zip(segment, lats.tolist(), lons.tolist()):
+        point.set('lat', f'{lat:.7f}')
+        point.set('lon', f'{lon:.7f}')
+
+    return etree.tostring(segment.getroottree(), xml_declaration=True, encoding='UTF-8')
+
+def calculate_distances(lats: np.ndarray, lons: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Calculate distances (km) and bearings (radians) between consecutive points of a track."""
     R = 6371  # Earth's radius in kilometers
 
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
+    lat_r = np.radians(lats)
+    lon_r = np.radians(lons)
+    dlat = np.diff(lat_r)
+    dlon = np.diff(lon_r)
+
+    # Compute each trigonometric term once and share it between distance and bearing
+    sin_lat = np.sin(lat_r)
+    cos_lat = np.cos(lat_r)
+    sin_half_dlat = np.sin(dlat/2)
+    sin_half_dlon = np.sin(dlon/2)
+    cos_half_dlon = np.cos(dlon/2)
+    # Double-angle identities avoid the cancellation of (1 - cos(dlon)) / 2 on tiny segments
+    sin_dlon = 2 * sin_half_dlon * cos_half_dlon
+    cos_dlon = 1 - 2 * sin_half_dlon**2
+
+    a = sin_half_dlat**2 + cos_lat[:-1] * cos_lat[1:] * sin_half_dlon**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    distances = R * c
+
+    y = sin_dlon * cos_lat[1:]
+    x = cos_lat[:-1] * sin_lat[1:] - sin_lat[:-1] * cos_lat[1:] * cos_dlon
+    bearings = np.arctan2(y, x)
 
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    distance = R * c
+    return distances, bearings
 
-    return distance
+@njit(cache=True, fastmath=True)
+def _short_segment(lat1: float, lon1: float, lat2: float, lon2: float, R: float) -> tuple[float, float]:
+    """Distance (m) and bearing (radians) of a short segment using the equirectangular approximation."""
+    # Kept in float64: these are scalars in registers, float32 only added conversions and was slower
+    x = (lon2 - lon1) * _DEG2RAD * math.cos((lat1 + lat2) / 2 * _DEG2RAD)
+    y = (lat2 - lat1) * _DEG2RAD
+    return R * math.sqrt(x * x + y * y), math.atan2(x, y)
 
-def anonymize_gpx(gpx_data: str) -> tuple[str, float, float]:
+@njit(parallel=True, cache=True, fastmath=True)
+def _analyze(lats: np.ndarray, lons: np.ndarray, R: float) -> tuple[np.ndarray, np.ndarray]:
+    """Calculate distances (m) and bearings (radians) between consecutive points, in parallel.
+
+    Runs on NUMBA_THREADS_PER_WORKER threads inside each pool worker (one by default).
+    """
+    n = lats.size - 1
+    dists = np.empty(n)
+    bearings = np.empty(n)
+
+    # Every segment is independent, so the points are split across the worker's threads
+    for i in prange(n):
+        # Same test as in _reconstruct: the segment's angular length against _SHORT_SEGMENT_RAD
+        dist, bearing = _short_segment(lats[i], lons[i], lats[i + 1], lons[i + 1], R)
+        if dist < _SHORT_SEGMENT_RAD * R:
+            dists[i] = dist
+            bearings[i] = bearing
+            continue
+
+        lat1 = lats[i] * _DEG2RAD
+        lat2 = lats[i + 1] * _DEG2RAD
+        dlon = (lons[i + 1] - lons[i]) * _DEG2RAD
+        sin_lat1 = math.sin(lat1)
+        cos_lat1 = math.cos(lat1)
+        sin_lat2 = math.sin(lat2)
+        cos_lat2 = math.cos(lat2)
+        sin_half_dlat = math.sin((lat2 - lat1) / 2)
+        sin_half_dlon = math.sin(dlon / 2)
+        cos_half_dlon = math.cos(dlon / 2)
+
+        # Haversine formula
+        a = sin_half_dlat**2 + cos_lat1 * cos_lat2 * sin_half_dlon**2
+        dists[i] = 2 * R * math.asin(math.sqrt(a))
+
+        bearings[i] = math.atan2(
+            2 * sin_half_dlon * cos_half_dlon * cos_lat2,
+            cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * (1 - 2 * sin_half_dlon**2)
+        )
+
+    return dists, bearings
+
+@njit(cache=True, fastmath=True)
+def _reconstruct(dists_m: np.ndarray, bearings: np.ndarray, R: float) -> tuple[np.ndarray, np.ndarray]:
+    """Rebuild a track from (0,0) given segment distances (m) and bearings, returning degrees."""
+    n = dists_m.size
+    new_lats = np.empty(n + 1)
+    new_lons = np.empty(n + 1)
+    new_lats[0] = 0.0
+    new_lons[0] = 0.0
+
+    # Previous anonymized point, in radians
+    prev_lat = 0.0
+    prev_lon = 0.0
+    cos_prev = 1.0
+
+    for i in range(n):
+        # Angular distance in radians
+        angular_dist = dists_m[i] / R
+
+        if angular_dist < _SHORT_SEGMENT_RAD:
+            # Flat-Earth projection, the curvature is negligible at this scale
+            prev_lat += angular_dist * math.cos(bearings[i])
+            prev_lon += angular_dist * math.sin(bearings[i]) / cos_prev
+        else:
+            # Project the segment from the previous anonymized point
+            sin_prev = math.sin(prev_lat)
+            cos_ad = math.cos(angular_dist)
+            sin_ad = math.sin(angular_dist)
+            sin_new = sin_prev * cos_ad + cos_prev * sin_ad * math.cos(bearings[i])
+            prev_lat = math.asin(sin_new)
+            prev_lon += math.atan2(math.sin(bearings[i]) * sin_ad * cos_prev, cos_ad - sin_prev * sin_new)
+        cos_prev = math.cos(prev_lat)
+
+        new_lats[i + 1] = prev_lat * _RAD2DEG
+        new_lons[i + 1] = prev_lon * _RAD2DEG
+
+    return new_lats, new_lons
+
+def anonymize_gpx(gpx_data: bytes) -> tuple[bytes, float, float]:
     """Anonymize GPX data by translating coordinates while preserving relative distances."""
     try:
-        gpx = gpxpy.parse(gpx_data)
-        
-        if not gpx.tracks:
-            raise ValueError("No tracks found in GPX file")
-        
-        track = gpx.tracks[0]
-        if not track.segments:
-            raise ValueError("No segments found in track")
-        
-        segment = track.segments[0]
-        if not segment.points:
-            raise ValueError("No points found in segment")
-        
-        # Store original points for verification
-        original_points = [(p.latitude, p.longitude, p.elevation if p.elevation else 0) for p in segment.points]
+        # Store original points as arrays for the vectorized passes
+        lats, lons, segment = _parse_track_points(gpx_data)
         
-        # Calculate original distances between consecutive points
-        original_distances = []
-        segment_distances = []
-        segment_bearings = []
-        
-        for i in range(len(segment.points) - 1):
-            p1, p2 = segment.points[i], segment.points[i + 1]
-            
-            # Calculate distance between consecutive points
-            dist = calculate_distance(p1.latitude, p1.longitude, p2.latitude, p2.longitude)
-            segment_distances.append(dist)
-            original_distances.append(dist * 1000)  # Store in meters
-            
-            # Calculate bearing between consecutive points
-            lat1, lon1 = math.radians(p1.latitude), math.radians(p1.longitude)
-            lat2, lon2 = math.radians(p2.latitude), math.radians(p2.longitude)
-            dlon = lon2 - lon1
-            y = math.sin(dlon) * math.cos(lat2)
-            x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dlon)
-            bearing = math.atan2(y, x)
-            segment_bearings.append(bearing)
-        
-        # Calculate total original distance
-        original_distance = sum(segment_distances)
+        # Calculate distances and bearings between consecutive points
+        original_distances, segment_bearings = _analyze(lats, lons, EARTH_RADIUS)
+        original_distance = float(original_distances.sum()) / 1000  # Convert to kilometers
         
         # Reconstruct the track starting from (0,0)
-        segment.points[0].latitude = 0
-        segment.points[0].longitude = 0
-        
-        # Earth's radius in meters
-        EARTH_RADIUS = 6371000
+        reconstruct = _reconstruct_ext or _reconstruct
+        new_lats, new_lons = reconstruct(original_distances, segment_bearings, EARTH_RADIUS)
         
-        for i in range(len(segment_distances)):
-            dist = segment_distances[i] * 1000  # Convert to meters
-            bearing = segment_bearings[i]
+        # The reconstruction preserves every segment distance by construction,
+        # so only re-measure the anonymized track when debugging
+        anonymized_distance = original_distance
+        if logger.isEnabledFor(logging.DEBUG):
+            # Verify distances with meter precision
+            anonymized_distances = calculate_distances(new_lats, new_lons)[0] * 1000  # Convert to meters
+            anonymized_distance = float(anonymized_distances.sum()) / 1000  # Convert back to kilometers
             
-            # Calculate new point position using direct distance
-            prev_lat = math.radians(segment.points[i].latitude)
-            prev_lon = math.radians(segment.points[i].longitude)
+            # Verify precision at meter level
+            diffs = np.abs(original_distances - anonymized_distances)
+            max_diff = float(diffs.max()) if diffs.size else 0.0
+            for i in np.flatnonzero(diffs > 1):  # More than 1 meter difference it is not good
+                logger.warning(f"Segment {i}: Distance mismatch of {diffs[i]:.2f} meters "
+                             f"(original: {original_distances[i]:.2f}m, anonymized: {anonymized_distances[i]:.2f}m)")
             
-            # Angular distance in radians
-            angular_dist = dist / EARTH_RADIUS
+            logger.debug(f"Maximum distance difference: {max_diff:.2f} meters")
             
-            # Calculate new position
-            new_lat = math.asin(
-                math.sin(prev_lat) * math.cos(angular_dist) +
-                math.cos(prev_lat) * math.sin(angular_dist) * math.cos(bearing)
-            )
-            
-            new_lon = prev_lon + math.atan2(
-                math.sin(bearing) * math.sin(angular_dist) * math.cos(prev_lat),
-                math.cos(angular_dist) - math.sin(prev_lat) * math.sin(new_lat)
-            )
-            
-            # Convert back to degrees
-            segment.points[i + 1].latitude = math.degrees(new_lat)
-            segment.points[i + 1].longitude = math.degrees(new_lon)
-            # Preserve elevation
-            segment.points[i + 1].elevation = original_points[i + 1][2]
-        
-        # Verify distances with meter precision
-        anonymized_distances = []
-        for i in range(len(segment.points) - 1):
-            p1, p2 = segment.points[i], segment.points[i + 1]
-            dist = calculate_distance(p1.latitude, p1.longitude, p2.latitude, p2.longitude)
-            anonymized_distances.append(dist * 1000)  # Convert to meters
-        
-        # Calculate total anonymized distance
-        anonymized_distance = sum(d / 1000 for d in anonymized_distances)  # Convert back to kilometers
+            # Log overall statistics
+            if abs(anonymized_distance - original_distance) > 0.001:  # 1 meter tolerance
+                logger.warning(f"Total distance mismatch: original={original_distance*1000:.2f}m, "
+                             f"anonymized={anonymized_distance*1000:.2f}m, "
+                             f"difference={abs(anonymized_distance-original_distance)*1000:.2f}m")
         
-        # Verify precision at meter level
-        max_diff = 0
-        for i, (orig, anon) in enumerate(zip(original_distances, anonymized_distances)):
-            diff = abs(orig - anon)
-            if diff > max_diff:
-                max_diff = diff
-            if diff > 1:  # More than 1 meter difference it is not good
-                logger.warning(f"Segment {i}: Distance mismatch of {diff:.2f} meters "
-                             f"(original: {orig:.2f}m, anonymized: {anon:.2f}m)")
-        
-        logger.info(f"Maximum distance difference: {max_diff:.2f} meters")
-        
-        # Log overall statistics
-        if abs(anonymized_distance - original_distance) > 0.001:  # 1 meter tolerance
-            logger.warning(f"Total distance mismatch: original={original_distance*1000:.2f}m, "
-                         f"anonymized={anonymized_distance*1000:.2f}m, "
-                         f"difference={abs(anonymized_distance-original_distance)*1000:.2f}m")
-        
-        return gpx.to_xml(), original_distance, anonymized_distance
+        return _build_gpx(segment, new_lats, new_lons), original_distance, anonymized_distance
     
     except Exception as e:
         logger.error(f"Error processing GPX file: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Error processing GPX file: {str(e)}")
 
+async def _anonymize_in_pool(gpx_data: bytes) -> tuple[bytes, float, float]:
+    """Run anonymize_gpx in a pool worker, replacing the pool once if it is broken.
+
+    A worker that dies (killed, out of memory) breaks the whole pool and every later
+    submit fails, so the broken pool is dropped and _get_pool() starts a new one.
+    Raises BrokenProcessPool if the new pool breaks as well.
+    """
+    global _pool
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            return await loop.run_in_executor(pool, anonymize_gpx, gpx_data)
+        except BrokenProcessPool:
+            if attempt:
+                raise
+            logger.error("Worker process pool is broken, starting a new one")
+            # Concurrent requests may have replaced it already
+            if _pool is pool:
+                pool.shutdown(wait=False)
+                _pool = None
+
 @app.post("/api/v1/anonymize", response_model=AnonymizedGPXResponse)
 async def anonymize_gpx_file(
     file: UploadFile = File(...)
@@ -185,69 +422,74 @@ async def anonymize_gpx_file(
     """
     Upload and anonymize a GPX file.
     """
-    start_time = datetime.now()
+    start_time = time.perf_counter()
     
     try:
         # Validate file type
         if not file.filename.endswith('.gpx'):
             raise HTTPException(status_code=400, detail="File must be a GPX file")
         
-        # Read file content
+        # Read file content, the parser decodes it from the XML declaration
         content = await file.read()
-        gpx_data = content.decode('utf-8')
         
         # Process GPX file
-        anonymized_gpx, original_distance, anonymized_distance = anonymize_gpx(gpx_data)
+        anonymized_gpx, original_distance, anonymized_distance = await _anonymize_in_pool(content)
         
-        processing_time = (datetime.now() - start_time).total_seconds()
+        processing_time = time.perf_counter() - start_time
         
         logger.info(f"Successfully processed GPX file: {file.filename}")
         logger.info(f"Original distance: {original_distance:.2f}km")
         logger.info(f"Anonymized distance: {anonymized_distance:.2f}km")
         logger.info(f"Processing time: {processing_time:.2f}s")
         
-        return AnonymizedGPXResponse(
-            gpx_data=anonymized_gpx,
+        # Serialized by pydantic-core directly, skipping the stdlib json encoder for the large gpx_data string
+        response = AnonymizedGPXResponse(
+            gpx_data=anonymized_gpx.decode('utf-8'),
             original_distance=original_distance,
             anonymized_distance=anonymized_distance,
             processing_time=processing_time
         )
+        return Response(content=response.model_dump_json(), media_type="application/json")
+    
+    except BrokenProcessPool:
+        logger.error(f"Error processing file {file.filename}: worker processes unavailable")
+        raise HTTPException(status_code=503, detail="Worker processes unavailable, try again later")
     
     except Exception as e:
         logger.error(f"Error processing file {file.filename}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/v1/anonymize/download", response_class=FileResponse)
+@app.post("/api/v1/anonymize/download", response_class=Response)
 async def anonymize_gpx_file_download(
     file: UploadFile = File(...)
 ):
     """
     Upload and anonymize a GPX file, returning the anonymized file directly.
     """
-    start_time = datetime.now()
+    start_time = time.perf_counter()
     
     try:
         # Validate file type
         if not file.filename.endswith('.gpx'):
             raise HTTPException(status_code=400, detail="File must be a GPX file")
         
-        # Read file content
+        # Read file content, the parser decodes it from the XML declaration
         content = await file.read()
-        gpx_data = content.decode('utf-8')
         
         # Process GPX file
-        anonymized_gpx, original_distance, anonymized_distance = anonymize_gpx(gpx_data)
+        anonymized_gpx, original_distance, anonymized_distance = await _anonymize_in_pool(content)
         
-        processing_time = (datetime.now() - start_time).total_seconds()
-        
-        # Create a temporary file to store the anonymized GPX
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.gpx', delete=False) as temp_file:
-            temp_file.write(anonymized_gpx)
-            temp_file_path = temp_file.name
+        processing_time = time.perf_counter() - start_time
         
         # Generate output filename
         original_filename = os.path.splitext(file.filename)[0]
         output_filename = f"{original_filename}_anonymized.gpx"
+        # Same encoding as FileResponse, non-ASCII names need the RFC 5987 form
+        quoted_filename = quote(output_filename)
+        if quoted_filename != output_filename:
+            content_disposition = f"attachment; filename*=utf-8''{quoted_filename}"
+        else:
+            content_disposition = f'attachment; filename="{output_filename}"'
         
         #some logs to check if everything is okay
         logger.info(f"Successfully processed GPX file: {file.filename}")
@@ -255,14 +497,17 @@ async def anonymize_gpx_file_download(
         logger.info(f"Anonymized distance: {anonymized_distance:.2f}km")
         logger.info(f"Processing time: {processing_time:.2f}s")
         
-        # Return the file with proper headers
-        return FileResponse(
-            temp_file_path,
+        # Return the serialized document from memory with proper headers, it is already UTF-8
+        return Response(
+            content=anonymized_gpx,
             media_type='application/gpx+xml',
-            filename=output_filename,
-            background=None  # This ensures the file is deleted after sending
+            headers={'Content-Disposition': content_disposition}
         )
     
+    except BrokenProcessPool:
+        logger.error(f"Error processing file {file.filename}: worker processes unavailable")
+        raise HTTPException(status_code=503, detail="Worker processes unavailable, try again later")
+    
     except Exception as e:
         logger.error(f"Error processing file {file.filename}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
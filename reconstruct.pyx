@@ -0,0 +1,52 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""Compiled track reconstruction, used by main.py instead of the Numba kernel when built."""
+import numpy as np
+
+from libc.math cimport sin, cos, asin, atan2, M_PI
+
+# Kept in sync with _SHORT_SEGMENT_RAD in main.py
+cdef double SHORT_SEGMENT_RAD = 0.001 * M_PI / 180.0
+cdef double RAD2DEG = 180.0 / M_PI
+
+
+def reconstruct(double[::1] dists, double[::1] bearings, double R):
+    """Rebuild a track from (0,0) given segment distances (m) and bearings, returning degrees."""
+    cdef Py_ssize_t n = dists.shape[0]
+    new_lats_arr = np.empty(n + 1)
+    new_lons_arr = np.empty(n + 1)
+    cdef double[::1] new_lats = new_lats_arr
+    cdef double[::1] new_lons = new_lons_arr
+    cdef Py_ssize_t i
+    cdef double angular_dist, sin_prev, cos_ad, sin_ad, sin_new
+    # Previous anonymized point, in radians
+    cdef double prev_lat = 0.0
+    cdef double prev_lon = 0.0
+    cdef double cos_prev = 1.0
+
+    new_lats[0] = 0.0
+    new_lons[0] = 0.0
+
+    # The loop only touches typed memory, so other threads can run meanwhile
+    with nogil:
+        for i in range(n):
+            # Angular distance in radians
+            angular_dist = dists[i] / R
+
+            if angular_dist < SHORT_SEGMENT_RAD:
+                # Flat-Earth projection, the curvature is negligible at this scale
+                prev_lat += angular_dist * cos(bearings[i])
+                prev_lon += angular_dist * sin(bearings[i]) / cos_prev
+            else:
+                # Project the segment from the previous anonymized point
+                sin_prev = sin(prev_lat)
+                cos_ad = cos(angular_dist)
+                sin_ad = sin(angular_dist)
+                sin_new = sin_prev * cos_ad + cos_prev * sin_ad * cos(bearings[i])
+                prev_lat = asin(sin_new)
+                prev_lon += atan2(sin(bearings[i]) * sin_ad * cos_prev, cos_ad - sin_prev * sin_new)
+            cos_prev = cos(prev_lat)
+
+            new_lats[i + 1] = prev_lat * RAD2DEG
+            new_lons[i + 1] = prev_lon * RAD2DEG
+
+    return new_lats_arr, new_lons_arr
@@ -0,0 +1,8 @@
+"""Builds the optional compiled reconstruction kernel: python setup.py build_ext --inplace"""
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="gpx-anonymous",
+    ext_modules=cythonize("reconstruct.pyx"),
+)